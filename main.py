@@ -7,35 +7,281 @@ labels the transcriptions using Google Gemini, and saves the
 results into a CSV file.
 
 Modules Used:
-- aiohttp for asynchronous HTTP requests.
-- BeautifulSoup for HTML parsing.
+- aiohttp and aiofiles for asynchronous HTTP requests and file I/O.
+- BeautifulSoup with lxml for HTML parsing.
 - yt_dlp for downloading YouTube videos as audio.
 - dotenv for loading environment variables.
+- orjson for fast JSON parsing and serialization.
 - groq and google.genai for API calls.
 """
 
 import asyncio
+import concurrent.futures
 import csv
-import json
+import hashlib
+import math
 import os
 import re
+import threading
+import time
 
+import aiofiles
 import aiohttp
 import dotenv
+import orjson
 import yt_dlp
 from bs4 import BeautifulSoup
 
-from groq import Groq
+from groq import AsyncGroq, RateLimitError
 from google import genai
 from google.genai import types
 
+# Optional: sentence-transformers enables the semantic label cache.
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
 # Load environment variables from .env file
 dotenv.load_dotenv(override=True)
 
 # Initialize API clients with keys from environment variables
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
 gemini_client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
 
+AWARD_URL = 'https://innoserve.tca.org.tw/award.aspx'
+
+# POST data for scraping the award page.
+AWARD_POST_DATA = {
+    '__VIEWSTATEGENERATOR': '362C9F34',
+    '__VIEWSTATE': 'CgP1/QbQHzFEi8nWVFxVT2CUBa0MRZ3PmTG4B42k2ivK4DLj65h52P3Zju4DMitvdqczd8DIO0f1VdmzkkX417a9E+16KtCotlCWaf2WyPsJAMcKh8EXjsyV3pJqjluyHUboD7kv+XX2oQE9r9S6jeeOPhnZ9DUEZDfkjml27dbFKuTyrOAuvn3daV8F+yjugb8mjxmIq4JTVHqLBMheEc5zHFJSbsN608wC4MZGCH3RZ3NPeMnsJRZQHDmiw9FL2Uc+YVUfKE7Luf29JG+sYSbt0BZPbo+MEgC54dDs/E6cwSqaDJVT12wVLpT+6wSWQBEOITcsVYlhaRF/FATitAZmTBry5HvosMaeiOXDlIiz42CfazgnD83+jqT9sIXDonV5scxgmvQ0YTvwz4rbXCEYVE2lsBycH/3FjXxBwyU9x0L/+OUh/3iaBu4rlXvTC/LH92KPRWp/YGXwWK4NsUqzrQ+VKaCwVIjvcIBsQnb2tr2RVRFCrC4NHJx/s8K7WBr86Zy7aHlp+0eqFCE54cjJgKvaWUMGvbUJ1Y9JTm7/ZPQJs0A//d6j4gIKpTokdTtf5TXhRwUNnWO6LqWwDB5TYbiP5f5kouDtfcV2mEQQYWx5oBsLDxGRYSdA18iPbp4Fd5hip1s2IFiNu7WafSidEjs7J3gAeVM2j6PmJH9oyjKt13hpgMN1HA3PCaw0U2B2mYQY1B4jj/KdpUpFaNVBey9YN9IjEc5yMkiBvNDYM9DVU/OuIELQ9wkjbEfL5HomCzna7q4aSIjg5yf1+a8g24lqci+t4rKfdjGTIAuEYvHsG0JB059IWsqcNVngUU0MwJ1dnA953MafTTdW68mZrNnw+x2D7lBDRojhxbUaE3HqJSKti5BC8bvX3VCuS3DN65ebNL7sp3jU6mXS5idTwIwBt+X32SvQw1wY+COEmXUt5BbwNasvSwUvTFmt7gJJ4cdqG4nimnnmmfETgrlONVgAmQAU10++OGTaCAzRsIzFzAphspTz1bsBkcwzuRkMRyifwp/OZSQc9ensNks/CiouoRLQ09nGt+3TyQT9OIvEcV0Dndzg3AnltihEbTSESY/wOQNaLCF2CfuqcyPEZV8DZX1Snte1M93lJeOhM6z8O7VUTD0VySE5hpljJsY4IuRSzAAKXGDTnPF5P3OBENECs4iWbgPlWLtF4mBwmJcEx1E58v91JvWEOnPrlefixtxKjltu87V9pTZchAwZgPAc3T87N1O8XNo7f8EXQo6NkgtULOAm1laebIXlyBP3Ya5RmC8eToqAWz66bH4wvFphmrdfz9V1CP7KPHCJJ8pFqIw0H8c9T9dBqV8QEfNL7Zphr/uahAEUO/g3uA79nXRtv4Sdq5PeVkHS4f/h/cHmpXlzIe3VNK6LyTmxwFaElIUsHsHwGVTg3259lUuYumswXVAhPdijr3+UuIRjCH0vAZT845f4OKKWtir+ttMJlnkAFLUBhEHso9niHyuRyAlzdAuiusTwICUz1BA6nrOgaLRBJ0lODcmYmEMrdmF6uk7SeKbQnma3DVz/nqFUx0tiLj6S7OKsW3O3fnEJDU1O+vZ6EDqB5kIVJEIj5xJXbi8ID9DDp5wXcDOfOvB4CXMXuBvNwBST2lfLVNgJSBRVdIcD0CDUG+4o2SVCiqGWX6B4XLoCg0eLyI3j5Z5klITJZQl/xqo8m8RV9mLK6AQ8Mfn0VLMFRB7E4zrfhrNWhvdUWzN7jt2YIZkXsce+vW7YAT2qtCGmz8T83RywrGELMbYDBbLkI7rkRmvq1Ag8S/DTA07T8G12aFKUcA6rqJXAtjR1or4UVLSE/KBQoHCx3/uHIzPpV/9VEOdPXU15flQNkwW39by98tZIn9jMtOE'
+}
+
+# HTML id of the award results table; pages without it are not cached.
+AWARD_TABLE_ID = 'ctl00_ContentPlaceHolder1_gv_award'
+
+# Competition years to scrape; only the latest one can still change.
+AWARD_YEARS = range(25, 30)
+
+# Directory for cached award pages, and how long the latest year's page stays fresh.
+AWARD_CACHE_DIR = ".cache"
+AWARD_CACHE_TTL = 7 * 24 * 60 * 60
+
+# Translation table removing characters that are not allowed in filenames.
+INVALID_FILENAME_CHARS = dict.fromkeys(map(ord, '\\/*?:"<>|'))
+
+# Matches a phrase of 5-50 characters repeated three or more times in a row,
+# which Whisper sometimes emits when it gets stuck.
+REPEATED_PHRASE_RE = re.compile(r'(.{5,50}?)\1{2,}')
+
+# Number of YouTube download workers; keep it moderate (8-16) to avoid
+# being rate-limited by YouTube.
+DOWNLOAD_CONCURRENCY = 8
+
+# Per-thread yt-dlp instances, reused across downloads, and every instance
+# created so they can be closed once the download stage ends.
+_youtube_dl_local = threading.local()
+_youtube_dl_instances = []
+_youtube_dl_instances_lock = threading.Lock()
+
+# Number of Groq transcription workers, and how many times a rate-limited
+# transcription is retried before giving up.
+TRANSCRIBE_CONCURRENCY = 6
+TRANSCRIBE_MAX_RETRIES = 5
+
+# Groq requests-per-minute quota for transcription.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "20"))
+
+# Groq Whisper model used for transcription, and the slower model used to
+# transcribe again when the first transcription contains invalid content.
+GROQ_WHISPER_MODEL = os.getenv("GROQ_WHISPER_MODEL", "whisper-large-v3-turbo")
+GROQ_WHISPER_FALLBACK_MODEL = "whisper-large-v3"
+
+# Strings marking a transcript as invalid (subtitle or volunteer credits).
+INVALID_TRANSCRIPT_MARKERS = ('字幕提供', '志願者')
+
+# Number of Gemini labeling workers, and how many attempts are made per
+# result before falling back to defaults.
+LABEL_CONCURRENCY = 8
+LABEL_MAX_RETRIES = 5
+
+GEMINI_MODEL = 'gemini-2.0-flash'
+
+# Shared limit of LABEL_CONCURRENCY concurrent Gemini calls, including chunk
+# calls; created on first use so it belongs to the running event loop.
+_gemini_semaphore = None
+
+# Transcripts longer than this many characters are labeled in equally sized
+# chunks of at most LABEL_CHUNK_SIZE characters whose labels are then merged.
+LABEL_CHUNK_THRESHOLD = 6000
+LABEL_CHUNK_SIZE = 4000
+
+# Semantic label cache: reuse the label of a previously labeled transcript whose
+# embedding is at least this similar. Disabled unless SEMANTIC_CACHE=1 is set
+# and sentence-transformers is installed.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_MODEL = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+SEMANTIC_CACHE_THRESHOLD = 0.95
+# The embedding model truncates input at 128 tokens, so transcripts are embedded
+# in chunks of this many characters and the chunk embeddings are averaged.
+SEMANTIC_CACHE_CHUNK_SIZE = 200
+
+# Gemini generation config used to label transcripts with a summary and key technologies.
+LABEL_CONFIG = types.GenerateContentConfig(
+    temperature=0,
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        required=["關鍵技術", "摘要"],
+        properties={
+            "關鍵技術": types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(type=types.Type.STRING),
+            ),
+            "摘要": types.Schema(type=types.Type.STRING),
+        },
+    ),
+    system_instruction=[
+        types.Part.from_text(text=(
+            "替專案內容進行分析，逐字稿可能會有錯字，請用你的知識修正補齊，"
+            "最終回傳關鍵技術和摘要，以精確的文字回覆，以繁體中文為主。"
+            "若分析不出專案內容（如逐字稿內容為字幕、志願者等無效資訊），回傳```無資訊```；"
+            "關鍵技術越仔細越好（如OCR、RAG、LLM模型名稱、YOLO等），但不要超過6個技術。"
+        )),
+    ],
+)
+
+class TokenBucket:
+    """
+    Asynchronous token bucket limiting how many requests are sent per minute.
+
+    Parameters:
+        rpm (int): The number of requests allowed per minute.
+    """
+
+    def __init__(self, rpm):
+        self.capacity = rpm
+        self.rate = rpm / 60
+        self.tokens = rpm
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def take(self):
+        """
+        Take a token, sleeping only when the bucket is empty.
+        """
+        async with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class SemanticLabelCache:
+    """
+    Cache of Gemini labels looked up by transcript embedding similarity.
+
+    Each entry embeds both the title and the whole transcript, so a hit needs
+    a similar title as well as similar content. Embeddings and labels are kept
+    in memory and persisted as "embeddings.npy" and "labels.json" in the
+    cache directory.
+
+    Parameters:
+        cache_dir (str): The directory where the index is stored.
+        threshold (float): The minimum cosine similarity for a cache hit.
+    """
+
+    def __init__(self, cache_dir, threshold=SEMANTIC_CACHE_THRESHOLD):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+        self.embeddings_path = os.path.join(cache_dir, "embeddings.npy")
+        self.labels_path = os.path.join(cache_dir, "labels.json")
+        dimension = 2 * self.model.get_sentence_embedding_dimension()
+        self.embeddings = np.empty((0, dimension), dtype=np.float32)
+        self.labels = []
+        if os.path.exists(self.embeddings_path) and os.path.exists(self.labels_path):
+            embeddings = np.load(self.embeddings_path)
+            # Ignore an index built with a different embedding layout.
+            if embeddings.shape[1] == dimension:
+                self.embeddings = embeddings
+                with open(self.labels_path, mode='rb') as f:
+                    self.labels = orjson.loads(f.read())
+
+    async def embed(self, title, transcript_text):
+        """
+        Compute the normalized embedding of a result in a worker thread.
+
+        The title embedding is concatenated with the average of the transcript's
+        chunk embeddings, so the cosine similarity of two entries is the mean of
+        their title and content similarities.
+
+        Parameters:
+            title (str): The title of the result.
+            transcript_text (str): The transcript to embed.
+
+        Returns:
+            numpy.ndarray: The embedding vector.
+        """
+        chunks = [
+            transcript_text[i:i + SEMANTIC_CACHE_CHUNK_SIZE]
+            for i in range(0, len(transcript_text), SEMANTIC_CACHE_CHUNK_SIZE)
+        ] or [title]
+
+        def encode():
+            title_embedding = self.model.encode(title, normalize_embeddings=True)
+            content_embedding = self.model.encode(chunks, normalize_embeddings=True).mean(axis=0)
+            content_embedding /= np.linalg.norm(content_embedding)
+            return np.concatenate([title_embedding, content_embedding]) / np.sqrt(2)
+
+        return await asyncio.to_thread(encode)
+
+    def lookup(self, embedding):
+        """
+        Find the label of the most similar cached transcript.
+
+        Parameters:
+            embedding (numpy.ndarray): The embedding of the transcript.
+
+        Returns:
+            dict or None: The cached label, or None if nothing is similar enough.
+        """
+        if not self.labels:
+            return None
+        sims = self.embeddings @ embedding
+        best = int(sims.argmax())
+        if sims[best] < self.threshold:
+            return None
+        return self.labels[best]
+
+    def add(self, embedding, label):
+        """
+        Add a labeled transcript to the cache.
+
+        Parameters:
+            embedding (numpy.ndarray): The embedding of the transcript.
+            label (dict): The label with "關鍵技術" and "摘要".
+        """
+        self.embeddings = np.vstack([self.embeddings, embedding])
+        self.labels.append(label)
+
+    def save(self):
+        """
+        Persist the cache to disk.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        np.save(self.embeddings_path, self.embeddings)
+        with open(self.labels_path, mode='wb') as f:
+            f.write(orjson.dumps(self.labels))
+
+
 def scrape_competition_data(html_content, year):
     """
     Scrape competition data from HTML content for a given year.
@@ -48,8 +294,8 @@ def scrape_competition_data(html_content, year):
         list of dict: A list containing competition results with keys:
             "屆數", "組別", "名次", "學校", "標題", "YOUTUBE連結".
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    table = soup.find('table', {'id': 'ctl00_ContentPlaceHolder1_gv_award'})
+    soup = BeautifulSoup(html_content, 'lxml')
+    table = soup.find('table', {'id': AWARD_TABLE_ID})
     
     if not table:
         print("Table not found in HTML content")
@@ -59,7 +305,8 @@ def scrape_competition_data(html_content, year):
     rows = table.find_all('tr')[1:]  # Skip header row
 
     for row in rows:
-        cells = row.find_all('td')
+        # Only the first 7 direct <td> children are needed
+        cells = row.find_all('td', recursive=False, limit=7)
         if len(cells) >= 7:
             group = cells[0].text.strip()
             rank = cells[1].text.strip()
@@ -67,7 +314,7 @@ def scrape_competition_data(html_content, year):
             title_cell = cells[4]
             title_text = title_cell.get_text(strip=True)
             # Remove characters that are not allowed in filenames
-            title_text = re.sub(r'[\\/*?:"<>|]', "", title_text)
+            title_text = title_text.translate(INVALID_FILENAME_CHARS)
             youtube_link = ""
             link_tag = title_cell.find('a')
             if link_tag and link_tag.has_attr('href'):
@@ -93,101 +340,288 @@ def save_to_csv(data, filename="competition_results.csv"):
         data (list of dict): The competition results.
         filename (str): The name of the CSV file to write.
     """
-    with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
+    with open(filename, 'w', newline='', encoding='utf-8-sig', buffering=1 << 20) as f:
         writer = csv.writer(f)
         writer.writerow(["屆數", "組別", "名次", "學校", "標題", "YOUTUBE連結", "摘要", "關鍵技術"])
-        for item in data:
-            writer.writerow([
-                item["屆數"],
-                item["組別"],
-                item["名次"],
-                item["學校"],
-                item["標題"],
-                item["YOUTUBE連結"],
-                item.get("摘要", "無資訊"),
-                item.get("關鍵技術", "[]")
-            ])
+        writer.writerows([
+            item["屆數"],
+            item["組別"],
+            item["名次"],
+            item["學校"],
+            item["標題"],
+            item["YOUTUBE連結"],
+            item.get("摘要", "無資訊"),
+            item.get("關鍵技術", "[]")
+        ] for item in data)
     
     print(f"Data saved to {filename}")
 
 
-async def label_data(results, output_dir="downloads"):
+async def read_transcript(transcript_path):
+    """
+    Read a transcript, rejecting it if it contains invalid content
+    (e.g. subtitle or volunteer credits).
+
+    Parameters:
+        transcript_path (str): The path of the transcript file.
+
+    Returns:
+        str or None: The transcript text, or None if it contains invalid content.
+    """
+    async with aiofiles.open(transcript_path, mode='r', encoding='utf-8') as f:
+        transcript_text = await f.read()
+    if any(marker in transcript_text for marker in INVALID_TRANSCRIPT_MARKERS):
+        return None
+    return transcript_text
+
+
+def clean_transcript(transcript_text):
+    """
+    Remove blank lines, consecutive duplicate lines and repeated phrases from
+    a transcript to cut the number of tokens sent to Gemini.
+
+    Parameters:
+        transcript_text (str): The raw transcript text.
+
+    Returns:
+        str: The cleaned transcript text.
     """
-    Use Google Gemini to label each result by generating a summary and key technologies.
-    If the transcript file (TXT) for a result does not exist or contains specific strings,
+    lines = []
+    for line in transcript_text.splitlines():
+        line = REPEATED_PHRASE_RE.sub(r'\1', line.strip())
+        if line and (not lines or lines[-1] != line):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+async def label_result(result, semantic_cache=None, output_dir="downloads"):
+    """
+    Use Google Gemini to label a result by generating a summary and key technologies.
+    If the transcript file (TXT) for the result does not exist or contains specific strings,
     defaults are added.
 
     Parameters:
-        results (list of dict): The competition data.
+        result (dict): The competition result to label in place.
+        semantic_cache (SemanticLabelCache): Optional cache of similar transcripts' labels.
+        output_dir (str): The directory where transcript files are stored.
+    """
+    transcript_path = os.path.join(output_dir, f"{result['標題']}.txt")
+    if not os.path.exists(transcript_path):
+        result["關鍵技術"] = "[]"
+        result["摘要"] = "無資訊"
+        return
+
+    transcript_text = await read_transcript(transcript_path)
+    if transcript_text is None:
+        result["關鍵技術"] = "[]"
+        result["摘要"] = "無資訊"
+        return
+
+    await label_one(result, clean_transcript(transcript_text), LABEL_CONFIG,
+                    semantic_cache, output_dir)
+
+
+def label_cache_path(title, transcript_text, config, output_dir="downloads"):
+    """
+    Build the on-disk cache path for a Gemini label.
+
+    The cache key is a SHA-256 hash of the model, title, transcript and
+    generation config, so any change to these produces a cache miss.
+
+    Parameters:
+        title (str): The title of the result.
+        transcript_text (str): The transcript sent to Gemini.
+        config (types.GenerateContentConfig): The Gemini generation config.
         output_dir (str): The directory where transcript files are stored.
 
     Returns:
-        list of dict: The updated results with "摘要" and "關鍵技術".
-    """
-    generate_content_config = types.GenerateContentConfig(
-        temperature=0.5,
-        response_mime_type="application/json",
-        response_schema=types.Schema(
-            type=types.Type.OBJECT,
-            required=["關鍵技術", "摘要"],
-            properties={
-                "關鍵技術": types.Schema(
-                    type=types.Type.ARRAY,
-                    items=types.Schema(type=types.Type.STRING),
-                ),
-                "摘要": types.Schema(type=types.Type.STRING),
-            },
-        ),
-        system_instruction=[
-            types.Part.from_text(text=(
-                "替專案內容進行分析，逐字稿可能會有錯字，請用你的知識修正補齊，"
-                "最終回傳關鍵技術和摘要，以精確的文字回覆，以繁體中文為主。"
-                "若分析不出專案內容（如逐字稿內容為字幕、志願者等無效資訊），回傳```無資訊```；"
-                "關鍵技術越仔細越好（如OCR、RAG、LLM模型名稱、YOLO等），但不要超過6個技術。"
-            )),
-        ],
-    )
+        str: The path of the cached label JSON file.
+    """
+    key = hashlib.sha256(orjson.dumps({
+        "m": GEMINI_MODEL,
+        "t": title,
+        "x": transcript_text,
+        "s": config.model_dump_json(),
+    }, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return os.path.join(output_dir, ".label_cache", f"{key}.json")
 
-    for result in results:
-        transcript_path = os.path.join(output_dir, f"{result['標題']}.txt")
-        if not os.path.exists(transcript_path):
-            result["關鍵技術"] = "[]"
-            result["摘要"] = "無資訊"
-            continue
-
-        with open(transcript_path, mode='r', encoding='utf-8') as f:
-            transcript_text = f.read()
-        
-        if '字幕提供' in transcript_text or '志願者' in transcript_text:
-            result["關鍵技術"] = "[]"
-            result["摘要"] = "無資訊"
-            continue
-
-        # Attempt to generate labels using Google Gemini
-        while True:
-            try:
+
+async def label_one(result, transcript_text, config, semantic_cache=None, output_dir="downloads"):
+    """
+    Label a single result with Google Gemini; long transcripts are labeled in chunks.
+    Labels are cached on disk and reused for unchanged transcripts, and
+    optionally for transcripts similar enough to a previously labeled one.
+    If every attempt fails, defaults are added.
+
+    Parameters:
+        result (dict): The competition result to label in place.
+        transcript_text (str): The transcript of the result's video.
+        config (types.GenerateContentConfig): The Gemini generation config.
+        semantic_cache (SemanticLabelCache): Optional cache of similar transcripts' labels.
+        output_dir (str): The directory where transcript files are stored.
+    """
+    cache_path = label_cache_path(result['標題'], transcript_text, config, output_dir)
+    if os.path.exists(cache_path):
+        async with aiofiles.open(cache_path, mode='rb') as f:
+            label_response = orjson.loads(await f.read())
+        result["關鍵技術"] = str(label_response["關鍵技術"])
+        result["摘要"] = label_response["摘要"]
+        return
+
+    if semantic_cache is not None:
+        embedding = await semantic_cache.embed(result['標題'], transcript_text)
+        label_response = semantic_cache.lookup(embedding)
+        if label_response is not None:
+            result["關鍵技術"] = str(label_response["關鍵技術"])
+            result["摘要"] = label_response["摘要"]
+            return
+
+    if len(transcript_text) > LABEL_CHUNK_THRESHOLD:
+        label_response = await label_long_transcript(result['標題'], transcript_text, config)
+    else:
+        label_response = await generate_label(
+            result['標題'],
+            ['#標題', result['標題'], '#影片逐字稿內容', transcript_text],
+            config
+        )
+    if label_response is None:
+        result["關鍵技術"] = "[]"
+        result["摘要"] = "無資訊"
+        return
+
+    result["關鍵技術"] = str(label_response["關鍵技術"])
+    result["摘要"] = label_response["摘要"]
+    print(f"{result['標題']}: {result['摘要']}")
+    print("關鍵技術:" + str(result["關鍵技術"]))
+
+    if semantic_cache is not None:
+        semantic_cache.add(embedding, label_response)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    async with aiofiles.open(cache_path, mode='wb') as f:
+        await f.write(orjson.dumps(label_response))
+
+
+def _get_gemini_semaphore():
+    """
+    Get the semaphore limiting concurrent Gemini calls, creating it on first use.
+
+    Returns:
+        asyncio.Semaphore: The shared Gemini semaphore.
+    """
+    global _gemini_semaphore
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(LABEL_CONCURRENCY)
+    return _gemini_semaphore
+
+
+async def generate_label(title, contents, config):
+    """
+    Call Google Gemini to generate a label, retrying with exponential backoff.
+    All calls share one semaphore limiting how many run at once.
+
+    Parameters:
+        title (str): The title of the result, used in log messages.
+        contents (list of str): The contents sent to Gemini.
+        config (types.GenerateContentConfig): The Gemini generation config.
+
+    Returns:
+        dict or None: The label with "關鍵技術" and "摘要", or None if every attempt fails.
+    """
+    for attempt in range(LABEL_MAX_RETRIES):
+        try:
+            async with _get_gemini_semaphore():
                 response = await gemini_client.aio.models.generate_content(
-                    model='gemini-2.0-flash',
-                    contents=['#標題', result['標題'], '#影片逐字稿內容', transcript_text],
-                    config=generate_content_config
+                    model=GEMINI_MODEL,
+                    contents=contents,
+                    config=config
                 )
-                label_response = json.loads(response.text)
-                result["關鍵技術"] = str(label_response["關鍵技術"])
-                result["摘要"] = label_response["摘要"]
-                print(f"{result['標題']}: {result['摘要']}")
-                print("關鍵技術:" + str(result["關鍵技術"]))
-                break
-            except Exception as e:
-                print(f"Failed to label text for {result['標題']}: {e}")
-                continue
+            label_response = orjson.loads(response.text)
+            return {
+                "關鍵技術": label_response["關鍵技術"],
+                "摘要": label_response["摘要"],
+            }
+        except Exception as e:
+            print(f"Failed to label text for {title}: {e}")
+            if attempt < LABEL_MAX_RETRIES - 1:
+                await asyncio.sleep(2 ** attempt)
+    return None
 
-    return results
 
+async def label_long_transcript(title, transcript_text, config):
+    """
+    Label a long transcript by labeling chunks of it concurrently, then asking
+    Google Gemini to merge the partial labels into a single one.
+
+    Parameters:
+        title (str): The title of the result.
+        transcript_text (str): The transcript of the result's video.
+        config (types.GenerateContentConfig): The Gemini generation config.
+
+    Returns:
+        dict or None: The merged label, or None if labeling any chunk or the
+        merge fails, so labels of incomplete transcripts are never cached.
+    """
+    # Split into equally sized chunks of at most LABEL_CHUNK_SIZE characters,
+    # so there is no tiny trailing chunk.
+    chunk_count = math.ceil(len(transcript_text) / LABEL_CHUNK_SIZE)
+    chunk_size = math.ceil(len(transcript_text) / chunk_count)
+    chunks = [
+        transcript_text[i:i + chunk_size]
+        for i in range(0, len(transcript_text), chunk_size)
+    ]
+    partials = await asyncio.gather(*(
+        generate_label(title, ['#標題', title, '#影片逐字稿內容（片段）', chunk], config)
+        for chunk in chunks
+    ))
+    if any(partial is None for partial in partials):
+        return None
+
+    return await generate_label(title, [
+        '#標題', title,
+        '#各片段分析結果', orjson.dumps(partials).decode(),
+        '#請合併各片段結果：關鍵技術取聯集且不要超過6個，並撰寫一份統一的摘要',
+    ], config)
+
+
+def _get_youtube_dl():
+    """
+    Get the yt-dlp instance of the current thread, creating it on first use.
+    Reusing it across downloads keeps extractor state and caches warm.
 
-async def download_audio_from_youtube(result, output_dir="downloads"):
+    Returns:
+        yt_dlp.YoutubeDL: The yt-dlp instance for this thread.
+    """
+    if not hasattr(_youtube_dl_local, "ydl"):
+        _youtube_dl_local.ydl = yt_dlp.YoutubeDL({
+            'format': 'bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'mp3',
+                'preferredquality': '192',
+            }]
+        })
+        with _youtube_dl_instances_lock:
+            _youtube_dl_instances.append(_youtube_dl_local.ydl)
+    return _youtube_dl_local.ydl
+
+
+def _close_youtube_dls():
+    """
+    Close every yt-dlp instance created by the download threads, saving the
+    cookie jar and closing their request handlers.
+    """
+    with _youtube_dl_instances_lock:
+        for ydl in _youtube_dl_instances:
+            ydl.close()
+        _youtube_dl_instances.clear()
+
+
+def _download_audio(result, output_dir="downloads"):
     """
     Download audio from a YouTube URL and convert it to MP3 using yt-dlp and ffmpeg.
-    
+    This call blocks and is meant to be run in a worker thread.
+
     Parameters:
         result (dict): A competition result containing a YouTube link.
         output_dir (str): The directory to save the downloaded audio.
@@ -196,46 +630,193 @@ async def download_audio_from_youtube(result, output_dir="downloads"):
         print("No YouTube link provided for:", result.get("標題"))
         return
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(output_dir, f"{result['標題']}.%(ext)s"),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }]
-    }
+    ydl = _get_youtube_dl()
+    # The output template is set per download so each file is named after its result.
+    # This relies on YoutubeDL.__init__ normalizing params['outtmpl'] into a dict
+    # and on prepare_filename() reading params['outtmpl']['default'] afresh for
+    # every download; instances are per thread, so this is never changed mid-download.
+    ydl.params['outtmpl']['default'] = os.path.join(output_dir, f"{result['標題']}.%(ext)s")
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([result["YOUTUBE連結"]])
+        ydl.download([result["YOUTUBE連結"]])
     except Exception as e:
         print(f"Failed to download audio from {result['YOUTUBE連結']}: {e}")
 
 
-def transcribe_audio(filename, output_dir="downloads"):
+async def download_audio_from_youtube(result, executor, output_dir="downloads"):
+    """
+    Download audio for a result in a thread of the download executor.
+
+    Parameters:
+        result (dict): A competition result containing a YouTube link.
+        executor (concurrent.futures.Executor): The executor running downloads.
+        output_dir (str): The directory to save the downloaded audio.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, _download_audio, result, output_dir)
+
+
+async def run_download_stage(in_queue, out_queue, output_dir="downloads"):
     """
-    Transcribe the audio file for a given title using the Groq client.
+    Run the download stage on a dedicated thread pool.
+
+    Downloads hold a thread for the whole yt-dlp and ffmpeg run, so they get
+    their own executor instead of the default one, which stays free for the
+    short file I/O of the other stages.
+    The yt-dlp instances used by the download threads are closed afterwards.
+
+    Parameters:
+        in_queue (asyncio.Queue): The queue results are taken from.
+        out_queue (asyncio.Queue): The queue downloaded results are put on.
+        output_dir (str): The directory to save the downloaded audio.
+    """
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor:
+            await run_stage(
+                lambda result: download_audio_from_youtube(result, executor, output_dir),
+                DOWNLOAD_CONCURRENCY, in_queue, out_queue
+            )
+    finally:
+        # The executor has shut down, so no download is using the instances.
+        _close_youtube_dls()
+
+
+async def request_transcription(filename, audio_path, model, bucket):
+    """
+    Request a transcription of an audio file from the Groq client.
+    Requests are paced by a token bucket, and rate-limited requests are
+    retried after the delay given by the API.
+
+    Parameters:
+        filename (str): The title corresponding to the audio file, used in log messages.
+        audio_path (str): The path of the audio file.
+        model (str): The Groq Whisper model to use.
+        bucket (TokenBucket): Paces requests to the Groq per-minute quota.
+
+    Returns:
+        str or None: The transcription, or None if it failed.
+    """
+    for attempt in range(TRANSCRIBE_MAX_RETRIES):
+        await bucket.take()
+        try:
+            with open(audio_path, "rb") as audio_file:
+                return await groq_client.audio.transcriptions.create(
+                    file=(os.path.basename(audio_path), audio_file),
+                    model=model,
+                    prompt="Specify context or spelling, respond in Traditional Chinese (zh-TW)",
+                    response_format="text",
+                    language="zh",
+                    temperature=0.01
+                )
+        except RateLimitError as e:
+            retry_after = float(e.response.headers.get("retry-after", 10))
+            print(f"Rate limited while transcribing {filename}, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+        except Exception as e:
+            print(f"Transcription failed for {filename}: {e}")
+            return None
+    print(f"Transcription failed for {filename}: rate limit retries exhausted")
+    return None
+
+
+async def transcribe_audio(filename, bucket, output_dir="downloads"):
+    """
+    Transcribe the audio file for a given title using the Groq client,
+    unless the audio could not be downloaded. If the transcription contains
+    invalid content, the audio is transcribed again with the fallback model.
 
     Parameters:
         filename (str): The title corresponding to the audio file.
+        bucket (TokenBucket): Paces requests to the Groq per-minute quota.
         output_dir (str): The directory where the audio and transcript are stored.
     """
     audio_path = os.path.join(output_dir, f"{filename}.mp3")
     transcript_path = os.path.join(output_dir, f"{filename}.txt")
-    try:
-        with open(audio_path, "rb") as audio_file:
-            transcription = groq_client.audio.transcriptions.create(
-                file=(audio_path, audio_file.read()),
-                model="whisper-large-v3",
-                prompt="Specify context or spelling, respond in Traditional Chinese (zh-TW)",
-                response_format="text",
-                language="zh",
-                temperature=0.01
-            )
-        with open(transcript_path, "w", encoding='utf-8') as transcript_file:
-            transcript_file.write(transcription)
-    except Exception as e:
-        print(f"Transcription failed for {filename}: {e}")
+    if not os.path.exists(audio_path):
+        return
+
+    print(f"Transcribing {filename}...")
+    transcription = await request_transcription(filename, audio_path, GROQ_WHISPER_MODEL, bucket)
+    if transcription is None:
+        return
+
+    if (GROQ_WHISPER_MODEL != GROQ_WHISPER_FALLBACK_MODEL
+            and any(marker in transcription for marker in INVALID_TRANSCRIPT_MARKERS)):
+        print(f"Transcribing {filename} again with {GROQ_WHISPER_FALLBACK_MODEL}...")
+        fallback = await request_transcription(
+            filename, audio_path, GROQ_WHISPER_FALLBACK_MODEL, bucket
+        )
+        if fallback is not None:
+            transcription = fallback
+
+    async with aiofiles.open(transcript_path, "w", encoding='utf-8') as transcript_file:
+        await transcript_file.write(transcription)
+
+
+async def fetch_year(session, year):
+    """
+    Fetch the award page HTML for a given competition year.
+
+    Pages are cached on disk; closed years are always served from the cache,
+    while the latest year is refetched once its cached page is older than
+    AWARD_CACHE_TTL.
+
+    Parameters:
+        session (aiohttp.ClientSession): The HTTP session to post with.
+        year (int): The competition year (e.g., 25, 26, ...)
+
+    Returns:
+        tuple: The year and the HTML content of the award page.
+    """
+    cache_path = os.path.join(AWARD_CACHE_DIR, f"award_{year}.html")
+    if os.path.exists(cache_path) and (
+        year < AWARD_YEARS[-1]
+        or time.time() - os.path.getmtime(cache_path) < AWARD_CACHE_TTL
+    ):
+        async with aiofiles.open(cache_path, mode='r', encoding='utf-8') as f:
+            return year, await f.read()
+
+    response = await session.post(AWARD_URL, data=AWARD_POST_DATA)
+    html_content = await response.text()
+    # Only cache real award pages, not maintenance or error pages.
+    if response.ok and AWARD_TABLE_ID in html_content:
+        os.makedirs(AWARD_CACHE_DIR, exist_ok=True)
+        async with aiofiles.open(cache_path, mode='w', encoding='utf-8') as f:
+            await f.write(html_content)
+    return year, html_content
+
+
+async def run_stage(handler, workers, in_queue, out_queue=None):
+    """
+    Run a pipeline stage with a pool of workers.
+
+    Each worker takes results from the input queue, processes them with the
+    handler and forwards them to the output queue. A None sentinel on the
+    input queue stops the workers; once they are all done, a sentinel is
+    passed on to the output queue.
+
+    Parameters:
+        handler (callable): Async function processing a single result.
+        workers (int): The number of concurrent workers.
+        in_queue (asyncio.Queue): The queue results are taken from.
+        out_queue (asyncio.Queue): The queue processed results are put on.
+    """
+    async def worker():
+        while True:
+            result = await in_queue.get()
+            if result is None:
+                # Put the sentinel back so the other workers stop too.
+                await in_queue.put(None)
+                return
+            try:
+                await handler(result)
+            except Exception as e:
+                print(f"Failed to process {result['標題']}: {e}")
+            if out_queue is not None:
+                await out_queue.put(result)
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    if out_queue is not None:
+        await out_queue.put(None)
 
 
 async def main():
@@ -250,42 +831,65 @@ async def main():
                        'AppleWebKit/537.36 (KHTML, like Gecko) '
                        'Chrome/133.0.0.0 Safari/537.36 Edg/133.0.0.0')
     }) as session:
-        # Loop through competition years (e.g., 25 to 29).
-        for year in range(25, 30):
-            data = {
-                '__VIEWSTATEGENERATOR': '362C9F34',
-                '__VIEWSTATE': 'CgP1/QbQHzFEi8nWVFxVT2CUBa0MRZ3PmTG4B42k2ivK4DLj65h52P3Zju4DMitvdqczd8DIO0f1VdmzkkX417a9E+16KtCotlCWaf2WyPsJAMcKh8EXjsyV3pJqjluyHUboD7kv+XX2oQE9r9S6jeeOPhnZ9DUEZDfkjml27dbFKuTyrOAuvn3daV8F+yjugb8mjxmIq4JTVHqLBMheEc5zHFJSbsN608wC4MZGCH3RZ3NPeMnsJRZQHDmiw9FL2Uc+YVUfKE7Luf29JG+sYSbt0BZPbo+MEgC54dDs/E6cwSqaDJVT12wVLpT+6wSWQBEOITcsVYlhaRF/FATitAZmTBry5HvosMaeiOXDlIiz42CfazgnD83+jqT9sIXDonV5scxgmvQ0YTvwz4rbXCEYVE2lsBycH/3FjXxBwyU9x0L/+OUh/3iaBu4rlXvTC/LH92KPRWp/YGXwWK4NsUqzrQ+VKaCwVIjvcIBsQnb2tr2RVRFCrC4NHJx/s8K7WBr86Zy7aHlp+0eqFCE54cjJgKvaWUMGvbUJ1Y9JTm7/ZPQJs0A//d6j4gIKpTokdTtf5TXhRwUNnWO6LqWwDB5TYbiP5f5kouDtfcV2mEQQYWx5oBsLDxGRYSdA18iPbp4Fd5hip1s2IFiNu7WafSidEjs7J3gAeVM2j6PmJH9oyjKt13hpgMN1HA3PCaw0U2B2mYQY1B4jj/KdpUpFaNVBey9YN9IjEc5yMkiBvNDYM9DVU/OuIELQ9wkjbEfL5HomCzna7q4aSIjg5yf1+a8g24lqci+t4rKfdjGTIAuEYvHsG0JB059IWsqcNVngUU0MwJ1dnA953MafTTdW68mZrNnw+x2D7lBDRojhxbUaE3HqJSKti5BC8bvX3VCuS3DN65ebNL7sp3jU6mXS5idTwIwBt+X32SvQw1wY+COEmXUt5BbwNasvSwUvTFmt7gJJ4cdqG4nimnnmmfETgrlONVgAmQAU10++OGTaCAzRsIzFzAphspTz1bsBkcwzuRkMRyifwp/OZSQc9ensNks/CiouoRLQ09nGt+3TyQT9OIvEcV0Dndzg3AnltihEbTSESY/wOQNaLCF2CfuqcyPEZV8DZX1Snte1M93lJeOhM6z8O7VUTD0VySE5hpljJsY4IuRSzAAKXGDTnPF5P3OBENECs4iWbgPlWLtF4mBwmJcEx1E58v91JvWEOnPrlefixtxKjltu87V9pTZchAwZgPAc3T87N1O8XNo7f8EXQo6NkgtULOAm1laebIXlyBP3Ya5RmC8eToqAWz66bH4wvFphmrdfz9V1CP7KPHCJJ8pFqIw0H8c9T9dBqV8QEfNL7Zphr/uahAEUO/g3uA79nXRtv4Sdq5PeVkHS4f/h/cHmpXlzIe3VNK6LyTmxwFaElIUsHsHwGVTg3259lUuYumswXVAhPdijr3+UuIRjCH0vAZT845f4OKKWtir+ttMJlnkAFLUBhEHso9niHyuRyAlzdAuiusTwICUz1BA6nrOgaLRBJ0lODcmYmEMrdmF6uk7SeKbQnma3DVz/nqFUx0tiLj6S7OKsW3O3fnEJDU1O+vZ6EDqB5kIVJEIj5xJXbi8ID9DDp5wXcDOfOvB4CXMXuBvNwBST2lfLVNgJSBRVdIcD0CDUG+4o2SVCiqGWX6B4XLoCg0eLyI3j5Z5klITJZQl/xqo8m8RV9mLK6AQ8Mfn0VLMFRB7E4zrfhrNWhvdUWzN7jt2YIZkXsce+vW7YAT2qtCGmz8T83RywrGELMbYDBbLkI7rkRmvq1Ag8S/DTA07T8G12aFKUcA6rqJXAtjR1or4UVLSE/KBQoHCx3/uHIzPpV/9VEOdPXU15flQNkwW39by98tZIn9jMtOE'
-            }
-            # End of POST data for scraping.
-            response_text = await session.post(
-                'https://innoserve.tca.org.tw/award.aspx', data=data
-            )
-            # Scrape and extend results with data for the current year.
-            results.extend(scrape_competition_data(await response_text.text(), year))
-    
-    # Download audio for each result if the MP3 doesn't exist.
-    for result in results:
-        audio_file = os.path.join("downloads", f"{result['標題']}.mp3")
-        if os.path.exists(audio_file):
-            continue
-        if "YOUTUBE連結" not in result or not result["YOUTUBE連結"]:
-            continue
-        await download_audio_from_youtube(result)
+        # Fetch all competition years (e.g., 25 to 29) concurrently.
+        pages = await asyncio.gather(
+            *(fetch_year(session, year) for year in AWARD_YEARS)
+        )
+        # Scrape and extend results with data for each year.
+        for year, html_content in pages:
+            results.extend(scrape_competition_data(html_content, year))
     
-    # Transcribe audio files that have been downloaded but not yet transcribed.
+    # Download, transcribe and label each result in a pipeline, so a result
+    # moves on to the next stage as soon as its previous stage is done.
+    download_queue, transcribe_queue, label_queue = (
+        asyncio.Queue(), asyncio.Queue(), asyncio.Queue()
+    )
+    # Results sharing a title share the same files, so only one of them (preferably
+    # one with a YouTube link) goes through the pipeline; the others copy its labels.
+    results_by_title = {}
     for result in results:
-        audio_file = os.path.join("downloads", f"{result['標題']}.mp3")
-        transcript_file = os.path.join("downloads", f"{result['標題']}.txt")
-        if not os.path.exists(audio_file):
-            continue
-        if os.path.exists(transcript_file):
-            continue
-        print(f"Transcribing {result['標題']}...")
-        transcribe_audio(result['標題'])
-        await asyncio.sleep(10)
-    
-    # Label the results using Google Gemini.
-    results = await label_data(results)
+        results_by_title.setdefault(result['標題'], []).append(result)
+    primaries = [
+        next((result for result in group if result.get("YOUTUBE連結")), group[0])
+        for group in results_by_title.values()
+    ]
+
+    # List the downloads directory once and route each result to the first
+    # stage it still needs, instead of checking its files in every stage.
+    existing_files = set(os.listdir("downloads")) if os.path.isdir("downloads") else set()
+    for result in primaries:
+        if f"{result['標題']}.txt" in existing_files:
+            label_queue.put_nowait(result)
+        elif f"{result['標題']}.mp3" in existing_files:
+            transcribe_queue.put_nowait(result)
+        elif result.get("YOUTUBE連結"):
+            download_queue.put_nowait(result)
+        else:
+            label_queue.put_nowait(result)
+    download_queue.put_nowait(None)
+
+    transcribe_bucket = TokenBucket(GROQ_RPM)
+    semantic_cache = None
+    if SEMANTIC_CACHE_ENABLED:
+        if SentenceTransformer is None:
+            print("SEMANTIC_CACHE=1 is set but sentence-transformers is not installed; "
+                  "semantic label cache disabled")
+        else:
+            semantic_cache = SemanticLabelCache(os.path.join("downloads", ".semantic_cache"))
+    await asyncio.gather(
+        run_download_stage(download_queue, transcribe_queue),
+        run_stage(lambda result: transcribe_audio(result['標題'], transcribe_bucket),
+                  TRANSCRIBE_CONCURRENCY, transcribe_queue, label_queue),
+        run_stage(lambda result: label_result(result, semantic_cache),
+                  LABEL_CONCURRENCY, label_queue),
+    )
+    if semantic_cache is not None:
+        semantic_cache.save()
+
+    for primary in primaries:
+        for result in results_by_title[primary['標題']]:
+            result["關鍵技術"] = primary.get("關鍵技術", "[]")
+            result["摘要"] = primary.get("摘要", "無資訊")
     
     # Save the final results to a CSV file.
     save_to_csv(results)